@@ -1,26 +1,35 @@
 #!/usr/bin/env python3
 
 import json
-import requests
+import functools
+import mmap
 import re
 import argparse
+import concurrent.futures
 import os
+import sys
+import threading
+import time
 from pathlib import Path
-from urllib.parse import urljoin
-from colorama import Fore, init
+from urllib.parse import quote
 
-# Initialize Colorama for colored output in the terminal
-init(autoreset=True)
+# Initialize Colorama for colored output in the terminal; skip it when output is redirected
+if sys.stdout.isatty():
+    from colorama import Fore, init
+    init(autoreset=True)
+else:
+    class Fore:
+        RED = ""
+        GREEN = ""
 
 # Get the path relative to the script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.join(script_dir, 'config.json')
 
 # Load configuration
+@functools.lru_cache(maxsize=1)
 def load_config(config_file='config.json'):
-    with open(config_file, 'r') as file:
-        config = json.load(file)
-    return config
+    return json.loads(Path(config_file).read_bytes())
 
 config = load_config(config_path)
 
@@ -32,73 +41,150 @@ HEADERS = {
     "Content-Type": "application/vnd.api+json",
 }
 
+# Patterns used to pull the workspace and organization out of terraform.tf
+WORKSPACE_PATTERN = re.compile(rb'workspaces\s*\{[^}]*name\s*=\s*"(.*?)"', re.DOTALL)
+ORGANIZATION_PATTERN = re.compile(rb'organization\s*=\s*"(.*?)"', re.DOTALL)
+
+# Terraform Cloud allows roughly 30 requests per second. This caps requests made through a
+# single TerraformCloudAPI instance; separate runs of the script are not paced against each other.
+RATE_LIMIT = 30
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode()
+
 class TerraformCloudAPI:
     def __init__(self):
-        self.base_url = API_BASE_URL
-        self.headers = HEADERS
+        # Without a real token every request would just come back 401, so stop before any network work
+        if API_TOKEN in ("", "API_TOKEN", "YOUR_API_TOKEN"):
+            raise SystemExit(f"{Fore.RED}API_TOKEN not configured in config.json")
+
+        # requests is slow to import, so only pay for it once an API client is needed
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        # Prefer orjson for request bodies when it is installed; the stdlib module works as a fallback
+        try:
+            import orjson
+            self._json_dumps = orjson.dumps
+        except ImportError:
+            self._json_dumps = _json_dumps
+
+        # Paths are appended directly to the base URL, so make sure it ends with a slash
+        self.base_url = API_BASE_URL.rstrip('/') + '/'
+        # Reuse one session so repeated calls share pooled keep-alive connections
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        # 429s are retried with backoff, waiting at least as long as any Retry-After header asks
+        retries = Retry(total=5, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504], allowed_methods=["PATCH", "GET"], raise_on_status=False)
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries))
+        # Requests run in the background so callers can keep working while they are in flight
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        # Token bucket shared by this client's worker threads to keep them at or below RATE_LIMIT
+        self._tokens = RATE_LIMIT
+        self._last_refill = time.monotonic()
+        self._rate_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.session.close()
 
     def patch_workspace(self, organization_name, workspace_name, data):
-        url = urljoin(self.base_url, f"organizations/{organization_name}/workspaces/{workspace_name}")
-        return requests.patch(url, json=data, headers=self.headers)
+        url = f"{self.base_url}organizations/{quote(organization_name, safe='')}/workspaces/{quote(workspace_name, safe='')}"
+        # Serialize up front; the session already sends the JSON:API Content-Type
+        body = self._json_dumps(data)
+        return self._pool.submit(self._send, self.session.patch, url, data=body)
+
+    def _send(self, method, url, **kwargs):
+        self._throttle()
+        return method(url, **kwargs)
+
+    def _throttle(self):
+        with self._rate_lock:
+            now = time.monotonic()
+            self._tokens = min(RATE_LIMIT, self._tokens + (now - self._last_refill) * RATE_LIMIT)
+            self._last_refill = now
+            if self._tokens < 1:
+                # Wait for the next token to accrue, then spend it straight away
+                time.sleep((1 - self._tokens) / RATE_LIMIT)
+                self._tokens = 0
+                self._last_refill = time.monotonic()
+            else:
+                self._tokens -= 1
 
 class WorkspaceManager:
     def __init__(self, api_client):
         self.api_client = api_client
+        self.pending_updates = []
 
     @staticmethod
     def find_workspace_and_org(filename="terraform.tf"):
         try:
-            with open(filename, "r") as file:
-                content = file.read()
-            workspace_name = WorkspaceManager._extract_value(content, 'workspaces {[^}]*name = "(.*?)"')
-            organization_name = WorkspaceManager._extract_value(content, 'organization = "(.*?)"')
+            if not os.stat(filename).st_size:
+                return None, None
+            # Search the mapped file directly rather than copying it into a string
+            with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                workspace_name = _extract_value(content, WORKSPACE_PATTERN)
+                organization_name = _extract_value(content, ORGANIZATION_PATTERN)
             return workspace_name, organization_name
         except FileNotFoundError:
-            print(Fore.RED + f"{filename} file not found in the current directory.\n")
+            print(f"{Fore.RED}{filename} file not found in the current directory.\n")
             return None, None
 
     def update_workspace_settings(self, organization_name, workspace_name, **kwargs):
         data = {"data": {"attributes": kwargs, "type": "workspaces"}}
-        response = self.api_client.patch_workspace(organization_name, workspace_name, data)
-        WorkspaceManager._log_response(response, kwargs)
-
-    @staticmethod
-    def _extract_value(content, pattern):
-        match = re.search(pattern, content, re.DOTALL)
-        return match.group(1) if match else None
-
-    @staticmethod
-    def _log_response(response, settings):
-        success_messages = {
-            "working-directory": "Successfully updated working directory to: {}",
-            "execution-mode": "Successfully updated workspace execution mode to: {}",
-            "trigger-patterns": "Successfully updated workspace trigger patterns to: {}",
-            "vcs-repo": "Successfully updated workspace branch to: {}",
-        }
-        
-        if response.status_code == 200:
-            for key, message in success_messages.items():
-                if key in settings:
-                    # Special handling for nested dictionaries like "vcs-repo"
-                    if isinstance(settings[key], dict) and key == "vcs-repo" and "branch" in settings[key]:
-                        print(Fore.GREEN + f"    ✓ {message.format(settings[key]['branch'])}")
-                    else:
-                        print(Fore.GREEN + f"    ✓ {message.format(settings[key])}")
-        else:
-            print(Fore.RED + f"    ✖ Failed to update workspace settings. Status code: {response.status_code}, Message: {response.text}\n")
-
-    @staticmethod
-    def find_repo_root(current_path):
-        path = Path(current_path)
-        for parent in [path] + list(path.parents):
-            if any((parent / '.git').exists() for child in parent.iterdir()):
-                return parent
-        return path
+        future = self.api_client.patch_workspace(organization_name, workspace_name, data)
+        self.pending_updates.append((future, kwargs))
+        return future
+
+    def wait_for_updates(self):
+        concurrent.futures.wait([future for future, _ in self.pending_updates])
+        pending_updates, self.pending_updates = self.pending_updates, []
+        for future, settings in pending_updates:
+            # Report each update on its own so one failed request doesn't hide the others
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"{Fore.RED}    ✖ Failed to update workspace settings ({', '.join(settings)}) due to an error: {e}\n")
+                continue
+            _log_response(response, settings)
+
+def _extract_value(content, pattern):
+    match = pattern.search(content)
+    return match.group(1).decode() if match else None
+
+def _log_response(response, settings):
+    success_messages = {
+        "working-directory": "Successfully updated working directory to: {}",
+        "execution-mode": "Successfully updated workspace execution mode to: {}",
+        "trigger-patterns": "Successfully updated workspace trigger patterns to: {}",
+        "vcs-repo": "Successfully updated workspace branch to: {}",
+    }
+    
+    if response.status_code == 200:
+        for key, value in settings.items():
+            message = success_messages.get(key)
+            if not message:
+                continue
+            # Special handling for nested dictionaries like "vcs-repo"
+            if isinstance(value, dict) and key == "vcs-repo" and "branch" in value:
+                print(f"{Fore.GREEN}    ✓ {message.format(value['branch'])}")
+            else:
+                print(f"{Fore.GREEN}    ✓ {message.format(value)}")
+    else:
+        print(f"{Fore.RED}    ✖ Failed to update workspace settings. Status code: {response.status_code}, Message: {response.text}\n")
 
-    @staticmethod
-    def get_working_directory():
-        repo_root = WorkspaceManager.find_repo_root(os.getcwd())
-        return os.path.relpath(os.getcwd(), start=repo_root)
+def find_repo_root(current_path):
+    path = Path(current_path)
+    for parent in (path, *path.parents):
+        if (parent / '.git').exists():
+            return parent
+    return path
 
 def build_settings(args):
     settings = {}
@@ -108,11 +194,14 @@ def build_settings(args):
         settings["execution-mode"] = "remote"
     if args.change_branch:
         settings["vcs-repo"] = {"branch": args.change_branch}
+    if args.set_working_directory or args.set_trigger_paths:
+        # Resolve the repo root once and share it between both settings
+        cwd = os.getcwd()
+        repo_root = find_repo_root(cwd)
+        relative_path = os.path.relpath(cwd, start=repo_root)
     if args.set_working_directory:
-        settings["working-directory"] = WorkspaceManager.get_working_directory()
+        settings["working-directory"] = relative_path
     if args.set_trigger_paths:
-        repo_root = WorkspaceManager.find_repo_root(os.getcwd())
-        relative_path = os.path.relpath(os.getcwd(), start=repo_root)
         settings["trigger-patterns"] = [f"{relative_path}/**/*", f"{relative_path}/common/**/*"]
     return settings
 
@@ -128,28 +217,36 @@ def main():
 
     args = parser.parse_args()
 
+    # Nothing to change, so don't bother reading terraform.tf or setting up the API client
+    if not (args.local or args.remote or args.change_branch or args.set_working_directory or args.set_trigger_paths or args.reset_workspace):
+        parser.error("no workspace settings requested; run with --help to see the available options")
+
     if args.reset_workspace:
         args.remote = True
         args.change_branch = 'main'
         args.set_working_directory = True
         args.set_trigger_paths = True
 
-    api_client = TerraformCloudAPI()
-    manager = WorkspaceManager(api_client)
+    # Look up the workspace before creating the API client, so a missing or incomplete
+    # terraform.tf never pays for importing requests or opening a session
+    workspace_name, organization_name = WorkspaceManager.find_workspace_and_org()
 
-    workspace_name, organization_name = manager.find_workspace_and_org()
+    if not (workspace_name and organization_name):
+        print(f"{Fore.RED}Failed to find workspace or organization name. Please check your terraform.tf file and try again.")
+        return
 
-    if workspace_name and organization_name:
-        print(Fore.GREEN + f"Workspace '{workspace_name}' found in organization '{organization_name}'.")
-        settings = build_settings(args)
-        if settings:
-            try:
-                manager.update_workspace_settings(organization_name, workspace_name, **settings)
-            except Exception as e:  
-                print(Fore.RED + f"Failed to update settings due to an error: {e}")
-                
-    else:
-        print(Fore.RED + "Failed to find workspace or organization name. Please check your terraform.tf file and try again.")
+    print(f"{Fore.GREEN}Workspace '{workspace_name}' found in organization '{organization_name}'.")
+    settings = build_settings(args)
+    if not settings:
+        return
+
+    with TerraformCloudAPI() as api_client:
+        manager = WorkspaceManager(api_client)
+        try:
+            manager.update_workspace_settings(organization_name, workspace_name, **settings)
+            manager.wait_for_updates()
+        except Exception as e:  
+            print(f"{Fore.RED}Failed to update settings due to an error: {e}")
 
 
 if __name__ == "__main__":